@@ -1,11 +1,30 @@
 import flet as ft
-import os
+from contextlib import nullcontext
 from math import pi
 
+
+class _FakeEvent:
+    """on_change ハンドラへ渡す疑似イベント(control 属性のみ)"""
+    __slots__ = ("control",)
+
+    def __init__(self, control):
+        self.control = control
+
 class Collapsible(ft.Stack):
+    # 三状態ごとのアイコン(True / False / None の順)
+    _ICON_CHECKED = ft.Icons.CHECK_BOX
+    _ICON_UNCHECKED = ft.Icons.CHECK_BOX_OUTLINE_BLANK
+    _ICON_INDETERMINATE = ft.Icons.INDETERMINATE_CHECK_BOX
+    _STATE_ICONS = (_ICON_CHECKED, _ICON_UNCHECKED, _ICON_INDETERMINATE)
+    _STATE_INDEX = {True: 0, False: 1, None: 2}
+
     def __init__(self, title: str, icon: ft.Icon, content: ft.Column):
         super().__init__()
+        # 走査時の isinstance 判定を避けるための種別タグ(ファイル側は False)
+        self.is_folder = True
         self.title = title
+        # フィルタ用に casefold したタイトルを保持
+        self._title_lower = title.casefold()
         self.icon = icon
         self.content = content
         
@@ -20,19 +39,49 @@ class Collapsible(ft.Stack):
 
         # 元の全子コントロールを保持(フィルタ復元に使用)
         self._original_controls = content.controls.copy()
+
+        # フィルタで自分または配下の表示内容が変わっているか、
+        # および表示内容が変わっている子フォルダ(復元時に辿る対象)
+        self._is_filtered = False
+        self._filtered_children = []
+
+        # 直近でマッチ無しだった検索文字列(これを前方に含む検索もマッチしない)
+        self._filter_miss = None
+
+        # 配下ファイルのチェック数と総数(三状態を差分更新で求める)
+        self._parent_folder = None
+        self._checked_count = 0
+        self._total_count = 0
+        for c in self._original_controls:
+            if c.is_folder:
+                c._parent_folder = self
+                self._checked_count += c._checked_count
+                self._total_count += c._total_count
+            else:
+                self._checked_count += int(bool(c._checkbox.value))
+                self._total_count += 1
+
+        # 配下の全フォルダ名・ファイル名は、最上位フォルダごとに1本の文字列へ平坦化し、
+        # 各フォルダはその中の自分の範囲だけを持つ(初めてフィルタするときに作る)
+        self._subtree_text = None
+        self._subtree_start = 0
+        self._subtree_end = 0
         
+        # 中身は初めて開いたときにページへ追加する(閉じたフォルダ配下は描画しない)
+        self._content_mounted = False
+
         # コールバック(親に通知するため)
         self.on_folder_checked = None
+        # 一括ON/OFF中に使うコンテキスト(親側で個々のファイルの通知をまとめるため)
+        self.batch_context = None
 
-    def build(self):
+        # 未表示のフォルダでも三状態を保持できるよう、ヘッダー部品はここで作る
         self.arrow = ft.Icon(
             name=ft.Icons.KEYBOARD_ARROW_DOWN,
             size=20,
             color=ft.Colors.GREY_700,
             rotate=0,
         )
-        
-        self.content.visible = self._expanded
 
         # フォルダのチェックボックスはアイコン切り替えで三状態を表現
         self.folder_checkbox = ft.IconButton(
@@ -40,27 +89,27 @@ class Collapsible(ft.Stack):
             on_click=self._folder_checkbox_clicked,
         )
 
+    def build(self):
+        self.content.visible = self._expanded
+
         return ft.Column(
             controls=[
                 ft.Container(
                     content=ft.Row(
                         controls=[
-                            ft.Row(
-                                controls=[
-                                    self.folder_checkbox,
-                                    self.icon,
-                                    ft.Text(
-                                        value=self.title,
-                                        size=14,
-                                        weight=ft.FontWeight.W_500,
-                                        color=ft.Colors.GREY_800,
-                                    ),
-                                ],
-                                spacing=5,
+                            self.folder_checkbox,
+                            self.icon,
+                            ft.Text(
+                                value=self.title,
+                                size=14,
+                                weight=ft.FontWeight.W_500,
+                                color=ft.Colors.GREY_800,
                             ),
+                            # 矢印を右端へ寄せるためのスペーサー
+                            ft.Container(expand=True),
                             self.arrow,
                         ],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                        spacing=5,
                         vertical_alignment=ft.CrossAxisAlignment.CENTER,
                     ),
                     padding=ft.padding.symmetric(horizontal=12, vertical=5),
@@ -69,114 +118,169 @@ class Collapsible(ft.Stack):
                     bgcolor=ft.Colors.SURFACE,
                     ink=True,
                 ),
-                ft.Container(
-                    content=self.content,
-                    padding=ft.padding.only(left=32),
-                ),
+                self._build_content_container(),
             ],
             spacing=0,
         )
 
+    def _build_content_container(self) -> ft.Container:
+        """子コントロールの入れ物。未展開の間は中身を持たせない"""
+        self._content_container = ft.Container(
+            content=self.content if self._content_mounted else None,
+            padding=ft.padding.only(left=32),
+        )
+        return self._content_container
+
     def restore_original_state(self):
         """フィルタ前の状態に復元"""
-        self.content.controls = self._original_controls.copy()
-        for control in self.content.controls:
-            if isinstance(control, Collapsible):
-                control.restore_original_state()
+        if not self._is_filtered:
+            return
+        # apply_filter は新しいリストを代入するだけなので、コピーせずに共有する
+        self.content.controls = self._original_controls
+        self._is_filtered = False
+        # 変更があった子フォルダだけを復元する
+        for control in self._filtered_children:
+            control.restore_original_state()
+        self._filtered_children = []
+
+    def apply_filter(self, query: str) -> bool:
+        """フォルダ／ファイル名による再帰的フィルタ(大文字・小文字は区別しない)"""
+        search_text = query.casefold()
+        if not search_text:
+            # 空文字は全てにマッチするので、元に戻すだけでよい
+            self.restore_original_state()
+            return True
+        return self._apply_filter_lower(search_text)
+
+    def _apply_filter_lower(self, search_text: str) -> bool:
+        """casefold 済みの検索文字列で再帰的にフィルタ"""
+        # 前回マッチ無しだった検索文字列で始まるなら、より長い検索でもマッチしない
+        if self._filter_miss is not None and search_text.startswith(self._filter_miss):
+            self._set_no_match()
+            return False
+
+        # 配下のどの名前にも含まれなければ、子を辿らずに不一致と判定
+        if self._subtree_text is None:
+            self._build_subtree_text()
+        if self._subtree_text.find(search_text, self._subtree_start, self._subtree_end) < 0:
+            self._filter_miss = search_text
+            self._set_no_match()
+            return False
 
-    def apply_filter(self, search_text: str) -> bool:
-        """フォルダ／ファイル名による再帰的フィルタ"""
         self.restore_original_state()
-        folder_name_match = (search_text in self.title.lower())
+        folder_name_match = (search_text in self._title_lower)
 
         filtered_controls = []
+        filtered_children = []
         for c in self.content.controls:
-            if isinstance(c, Collapsible):
-                if c.apply_filter(search_text):
+            if c.is_folder:
+                if c._apply_filter_lower(search_text):
                     filtered_controls.append(c)
+                if c._is_filtered:
+                    filtered_children.append(c)
             else:
-                file_path = c.content.controls[0].data
-                file_name = os.path.basename(file_path).lower()
-                if search_text in file_name:
+                if search_text in c._file_name_lower:
                     filtered_controls.append(c)
 
-        if folder_name_match:
-            # フォルダ名がマッチしているなら全て残す
+        if folder_name_match or len(filtered_controls) == len(self.content.controls):
+            # フォルダ名がマッチしている、または全てマッチしたなら全て残す
             pass
         else:
             self.content.controls = filtered_controls
+        self._filtered_children = filtered_children
+        self._is_filtered = (
+            self.content.controls is not self._original_controls
+            or len(filtered_children) > 0
+        )
 
         has_visible_files = folder_name_match or (len(filtered_controls) > 0)
+        if not has_visible_files:
+            self._filter_miss = search_text
         return has_visible_files
 
-    def get_all_files(self):
-        """フォルダ配下のファイルを再帰的に取得"""
-        files = []
-        for c in self.content.controls:
-            if isinstance(c, Collapsible):
-                files.extend(c.get_all_files())
+    def _build_subtree_text(self):
+        """最上位フォルダ配下の名前を1本の文字列にまとめ、各フォルダに範囲を割り当てる"""
+        root = self
+        while root._parent_folder is not None:
+            root = root._parent_folder
+        names = []
+        folders = []
+        root._collect_subtree_names(names, folders, 0)
+        text = "\n".join(names)
+        for folder in folders:
+            folder._subtree_text = text
+
+    def _collect_subtree_names(self, names: list, folders: list, pos: int) -> int:
+        """自分と配下の名前を names に追加し、文字列中の自分の範囲を記録する"""
+        folders.append(self)
+        self._subtree_start = pos
+        names.append(self._title_lower)
+        pos += len(self._title_lower) + 1
+        for c in self._original_controls:
+            if c.is_folder:
+                pos = c._collect_subtree_names(names, folders, pos)
             else:
-                files.append(c)
-        return files
+                names.append(c._file_name_lower)
+                pos += len(c._file_name_lower) + 1
+        self._subtree_end = pos
+        return pos
+
+    def _set_no_match(self):
+        """マッチ無しの状態にする(子を辿って評価した場合と同じく中身を空にする)"""
+        self.restore_original_state()
+        self.content.controls = []
+        self._is_filtered = True
 
-    def set_files_checked(self, checked: bool):
+    def set_files_checked(self, checked: bool, defer_update: bool = False):
         """
         フォルダ配下の全ファイルを一括でON/OFF。
         三状態のうち「全部ON or 全部OFF」のときに呼ばれる。
+        UI更新は最上位の呼び出しでまとめて1回だけ行う(defer_update=True なら呼び出し側で行う)。
         """
-        self._folder_state = checked  # True or False
-        self.folder_checkbox.icon = self._get_icon_by_state()
-        self.folder_checkbox.update()
-
-        # 配下を全部同じに
+        # 配下を全部同じに(既に目的の状態のものは触らない)
         for c in self.content.controls:
-            if isinstance(c, Collapsible):
-                c.set_files_checked(checked)
+            if c.is_folder:
+                if c._checked_count != (c._total_count if checked else 0):
+                    c.set_files_checked(checked, defer_update=True)
             else:
-                checkbox = c.content.controls[0]
+                checkbox = c._checkbox
+                if bool(checkbox.value) == checked:
+                    continue
                 checkbox.value = checked
                 if checkbox.on_change:
-                    fake_event = type('Event', (), {'control': checkbox})()
-                    checkbox.on_change(fake_event)
-                checkbox.update()
+                    checkbox.on_change(_FakeEvent(checkbox))
 
-        self.update()
+        # フィルタで対象外のファイルは変わらないので、三状態はチェック数から決める
+        self._apply_checked_count()
 
-    def recalc_folder_state(self):
+        if not defer_update:
+            self.update()
+
+    def on_leaf_toggled(self, delta: int):
         """
-        下位ファイル・フォルダの状態から自分の三状態を再計算。
+        配下ファイルのチェック数の増減(+1/-1)を自分と祖先フォルダに反映。
+        アイコンの値のみ変更するので、UI更新は呼び出し側で行う。
         """
-        all_files = self.get_all_files()
-        if not all_files:
-            # 下位にファイルが無ければ「未選択」として扱う
+        node = self
+        while node is not None:
+            node._checked_count += delta
+            node._apply_checked_count()
+            node = node._parent_folder
+
+    def _apply_checked_count(self):
+        """チェック数から三状態とアイコンを決める"""
+        if self._checked_count == 0:
+            # 下位にファイルが無い場合も「未選択」として扱う
             self._folder_state = False
+        elif self._checked_count >= self._total_count:
+            self._folder_state = True
         else:
-            values = []
-            for file_control in all_files:
-                cb = file_control.content.controls[0]
-                values.append(bool(cb.value))
-
-            all_on = all(values)
-            none_on = not any(values)
-
-            if all_on:
-                self._folder_state = True
-            elif none_on:
-                self._folder_state = False
-            else:
-                self._folder_state = None  # 一部のみ
-
+            self._folder_state = None  # 一部のみ
         self.folder_checkbox.icon = self._get_icon_by_state()
-        self.folder_checkbox.update()
 
     def _get_icon_by_state(self):
         """_folder_state (三状態) に対応するアイコンを返す"""
-        if self._folder_state is True:
-            return ft.Icons.CHECK_BOX
-        elif self._folder_state is False:
-            return ft.Icons.CHECK_BOX_OUTLINE_BLANK
-        else:
-            return ft.Icons.INDETERMINATE_CHECK_BOX  # None → 部分チェック
+        return self._STATE_ICONS[self._STATE_INDEX[self._folder_state]]
 
     def _toggle_expanded(self, e):
         # 開閉切り替え
@@ -184,9 +288,13 @@ class Collapsible(ft.Stack):
             # アイコンボタンをクリックした場合はここで処理しない
             return
         self._expanded = not self._expanded
+        if self._expanded and not self._content_mounted:
+            # 初回展開時に中身をページへ追加
+            self._content_mounted = True
+            self._content_container.content = self.content
         self.content.visible = self._expanded
         self.arrow.rotate = pi if self._expanded else 0
-        self.arrow.update()
+        # 矢印も含めて1回の更新で反映する
         self.update()
 
     def _folder_checkbox_clicked(self, e):
@@ -194,12 +302,11 @@ class Collapsible(ft.Stack):
         フォルダのアイコンボタン（チェックボックス）をクリックしたときの処理。
         状態を次にローテーションさせる or UIとしては単に「全ON/全OFF切り替え」でもOK。
         """
-        if self._folder_state is True:
-            # すべてON → すべてOFFへ
-            self.set_files_checked(False)
-        else:
-            # すべてOFFまたは部分 → すべてONへ
-            self.set_files_checked(True)
+        # すべてON → すべてOFFへ、すべてOFFまたは部分 → すべてONへ
+        checked = self._folder_state is not True
+        with self.batch_context() if self.batch_context else nullcontext():
+            # 親へ通知する場合、UI更新は通知先でまとめて行う
+            self.set_files_checked(checked, defer_update=self.on_folder_checked is not None)
 
         # 親へ通知
         if self.on_folder_checked:
@@ -1,9 +1,13 @@
 import flet as ft
 import os
 import json
-from typing import Dict, List
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from controls.collapsible import Collapsible
-from datetime import datetime
+from functools import lru_cache
 
 
 class WindowControlButton(ft.IconButton):
@@ -110,6 +114,42 @@ class WindowTitleBar(ft.Stack):
 
 
 CONFIG_FILE = "config.json"
+# 検索ボックスの入力が止まってからフィルタを適用するまでの待ち時間(秒)
+FILTER_DEBOUNCE_SECONDS = 0.15
+# 選択ファイルがこの数を超えたらスレッドで並行して読み込む
+PARALLEL_READ_THRESHOLD = 4
+MAX_READ_WORKERS = 16
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+# バイナリ判定のために読む先頭バイト数と、その場合の出力
+BINARY_SNIFF_SIZE = 8192
+BINARY_PLACEHOLDER = "[バイナリファイルのため省略]"
+
+
+class _LoadedTree:
+    """バックグラウンドで読み込んだ一覧(読み込み完了後にまとめて差し替える)"""
+    __slots__ = (
+        "controls", "file_paths", "rel_paths", "rel_parts",
+        "sort_keys", "file_order", "check_values", "parent_folders", "dir_cache",
+    )
+
+    def __init__(self):
+        self.controls: list = []
+        self.file_paths: List[str] = []
+        self.rel_paths: Dict[str, str] = {}
+        self.rel_parts: Dict[str, Tuple[str, ...]] = {}
+        self.sort_keys: Dict[str, dict] = {"name": {}, "date": {}, "size": {}}
+        self.file_order: Dict[str, int] = {}
+        self.check_values: Dict[str, bool] = {}
+        self.parent_folders: Dict[str, Collapsible] = {}
+        # 今回走査したディレクトリの一覧だけを次回用のキャッシュとして残す
+        self.dir_cache: Dict[str, Tuple[int, List[Tuple[str, bool]]]] = {}
+
+
+@lru_cache(maxsize=4096)
+def _format_minute(minute: int) -> str:
+    """エポックからの分数を日時文字列に変換(同じ分のファイルは結果を共有)"""
+    return time.strftime("%Y/%m/%d %H:%M", time.localtime(minute * 60))
+
 
 class MarkdownCollector:
     """マークダウンファイルコレクターのメインクラス"""
@@ -125,6 +165,8 @@ class MarkdownCollector:
         
         # 設定を読み込む
         self.config = self._load_config()
+        # ファイルと同じ内容かどうかを判定するためのハッシュ
+        self._config_hash = self._hash_config()
 
         # 設定から復元 or デフォルト値
         self.folder_path = self.config.get("last_folder_path", "")
@@ -136,10 +178,34 @@ class MarkdownCollector:
         })
 
         self.file_paths: List[str] = []
-        self.file_info: Dict[str, dict] = {}
+        self.rel_paths: Dict[str, str] = {}
+        self.rel_parts: Dict[str, Tuple[str, ...]] = {}
+        self.sort_keys: Dict[str, dict] = {"name": {}, "date": {}, "size": {}}
+        # ディレクトリ一覧のキャッシュ(パス → (更新日時, [(名前, フォルダか)]))
+        # 読み込みごとに走査したディレクトリ分へ入れ替わるので、現在のフォルダ配下の数を超えない
+        self._dir_cache: Dict[str, Tuple[int, List[Tuple[str, bool]]]] = {}
+        # 選択中ファイルの出力ブロック(パス → ((サイズ, 更新日時), ブロック文字列))
+        self._rendered_blocks: Dict[str, Tuple[Optional[Tuple[int, int]], str]] = {}
+        # 出力時の並び順(読み込み順)
+        self.file_order: Dict[str, int] = {}
         self.check_values: Dict[str, bool] = {}
+        self.parent_folders: Dict[str, Collapsible] = {}
         self.original_controls = []
 
+        # 検索入力のデバウンス用タイマー
+        self._filter_timer: Optional[threading.Timer] = None
+        self._filter_lock = threading.Lock()
+
+        # 一括操作中は個々のチェック変更で出力・UIを更新しない
+        self._defer_output = False
+
+        # バックグラウンド処理(フォルダ読み込み・出力生成)の排他制御
+        self._load_lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        # 未処理の出力要求の数(最後に処理された要求だけが出力欄へ反映する)
+        self._output_pending = 0
+        self._output_pending_lock = threading.Lock()
+
         # UI初期化
         self.settings_dialog = None
         self.file_picker = ft.FilePicker(on_result=self.get_folder_result)
@@ -177,6 +243,8 @@ class MarkdownCollector:
             text_size=14,
         )
 
+        self.loading_indicator = ft.ProgressBar(visible=False)
+
         self.files_column = ft.ListView(
             expand=True,
             spacing=2,
@@ -289,12 +357,11 @@ class MarkdownCollector:
         files_section = ft.Container(
             content=ft.Column([
                 toolbar_container,
+                self.loading_indicator,
                 ft.Container(
-                    content=ft.Column(
-                        [self.files_column],
-                        scroll=ft.ScrollMode.AUTO,
-                        expand=True,
-                    ),
+                    # ListView 自身にスクロールさせ、表示範囲の行だけを描画させる
+                    # (スクロール可能な Column で包むと全行が一度に描画される)
+                    content=self.files_column,
                     border=ft.border.all(1, ft.Colors.OUTLINE_VARIANT),
                     border_radius=8,
                     expand=True,
@@ -383,48 +450,104 @@ class MarkdownCollector:
 
     def get_folder_result(self, e: ft.FilePickerResultEvent):
         if e.path:
+            # フォルダを選び直したときは常に最新の状態を読み込む
+            self._dir_cache.clear()
             self.folder_path = e.path
             self.folder_label.value = f"選択されたフォルダ: {self.folder_path}"
             self._load_files()
             self.page.update()
 
     def _load_files(self):
-        self.files_column.controls.clear()
-        self.check_values.clear()
-        self.file_paths = []
-        self.file_info.clear()
-        self.original_controls.clear()
+        """フォルダを読み込む。走査中は UI を止めないようバックグラウンドで行う"""
+        self.loading_indicator.visible = True
+        self.page.update()
+        self.page.run_thread(self._load_files_in_background)
 
-        if not os.path.isdir(self.folder_path):
+    def _load_files_in_background(self):
+        with self._load_lock:
+            try:
+                self._load_files_sync()
+            finally:
+                self.loading_indicator.visible = False
+                self.page.update()
+
+    def _load_files_sync(self):
+        # 出力・フィルタのスレッドが参照中の辞書は触らず、新しい一覧を別に組み立てる
+        tree = _LoadedTree()
+        folder_exists = os.path.isdir(self.folder_path)
+        if folder_exists:
+            # 除外判定用に集合・タプルへ変換しておく(endswith はタプルを一度に判定できる)
+            self._excluded_exts = tuple(self.exclude_patterns['extensions'])
+            self._excluded_files = set(self.exclude_patterns['files'])
+            self._excluded_folders = set(self.exclude_patterns['folders'])
+
+            try:
+                self._load_directory(self.folder_path, tree.controls, tree)
+            except Exception as e:
+                self._show_error(f"ファイル一覧の読み込みに失敗: {e}")
+
+        # 組み立て終わった一覧を、出力・フィルタ処理と排他してまとめて差し替える
+        with self._output_lock, self._filter_lock:
+            self.files_column.controls = tree.controls
+            self.original_controls = tree.controls.copy()
+            self.file_paths = tree.file_paths
+            self.rel_paths = tree.rel_paths
+            self.rel_parts = tree.rel_parts
+            self.sort_keys = tree.sort_keys
+            self.file_order = tree.file_order
+            self.check_values = tree.check_values
+            self.parent_folders = tree.parent_folders
+            self._dir_cache = tree.dir_cache
+            self._rendered_blocks = {}
+
+        if not folder_exists:
             self.page.update()
             return
 
-        try:
-            self._load_directory(self.folder_path, self.files_column.controls)
-        except Exception as e:
-            self._show_error(f"ファイル一覧の読み込みに失敗: {e}")
-
-        self.original_controls = self.files_column.controls.copy()
-
         # ソート & 更新
         self._sort_files()
         self.page.update()
 
-        # 最後に選択したフォルダを設定ファイルに保存
-        self.config["last_folder_path"] = self.folder_path
-        self._save_config()
-
-    def _load_directory(self, directory: str, controls: list):
-        items = os.listdir(directory)
-        items = [item for item in items if not self._should_exclude(os.path.join(directory, item), item)]
-        
-        folders = sorted([i for i in items if os.path.isdir(os.path.join(directory, i))])
-        files = sorted([i for i in items if os.path.isfile(os.path.join(directory, i))])
+        # 最後に選択したフォルダを設定ファイルに保存(変わったときだけ)
+        if self.config.get("last_folder_path") != self.folder_path:
+            self.config["last_folder_path"] = self.folder_path
+            self._save_config()
 
-        for folder in folders:
-            folder_path = os.path.join(directory, folder)
+    def _load_directory(
+        self,
+        directory: str,
+        controls: list,
+        tree: _LoadedTree,
+        mtime_ns: Optional[int] = None,
+    ):
+        folders: List[Tuple[str, Optional[os.DirEntry]]] = []
+        files: List[Tuple[str, os.stat_result]] = []
+        for name, is_dir, entry in self._scan_directory(directory, tree, mtime_ns):
+            if self._should_exclude(name, is_dir):
+                continue
+            if is_dir:
+                folders.append((name, entry))
+                continue
+            # 今回走査したエントリは DirEntry の stat 結果を使い(Windows では追加の syscall 無し)、
+            # キャッシュから得た名前だけは取り直す(中身を書き換えてもディレクトリの更新日時は変わらない)
+            try:
+                if entry is not None:
+                    stat = entry.stat()
+                else:
+                    stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_size > self.exclude_patterns['max_file_size']:
+                continue
+            files.append((name, stat))
+        folders.sort(key=lambda item: item[0])
+        files.sort(key=lambda item: item[0])
+
+        for folder, entry in folders:
             folder_controls = []
-            self._load_directory(folder_path, folder_controls)
+            # 今回走査したフォルダなら、その更新日時を使ってキャッシュを判定する
+            sub_mtime_ns = entry.stat().st_mtime_ns if entry is not None else None
+            self._load_directory(os.path.join(directory, folder), folder_controls, tree, sub_mtime_ns)
             if folder_controls:  # 中身がある場合のみ
                 collapsible = Collapsible(
                     title=folder,
@@ -432,25 +555,31 @@ class MarkdownCollector:
                     content=ft.Column(controls=folder_controls, spacing=2)
                 )
                 collapsible.on_folder_checked = lambda c=collapsible: self._update_folder_state(c)
+                collapsible.batch_context = self._deferred_output
+                for c in folder_controls:
+                    if not c.is_folder:
+                        tree.parent_folders[c._checkbox.data] = collapsible
                 controls.append(collapsible)
 
-        for file in files:
+        for file, stat in files:
             file_path = os.path.join(directory, file)
-            stat = os.stat(file_path)
-            self.file_info[file_path] = {
-                "name": file,
-                "size": stat.st_size,
-                "modified": stat.st_mtime,
-            }
+            rel_path = os.path.relpath(file_path, self.folder_path)
+            tree.rel_paths[file_path] = rel_path
+            tree.rel_parts[file_path] = tuple(rel_path.split(os.sep))
+            file_name_lower = file.casefold()
+            tree.sort_keys["name"][file_path] = file_name_lower
+            tree.sort_keys["date"][file_path] = stat.st_mtime
+            tree.sort_keys["size"][file_path] = stat.st_size
+            checkbox = ft.Checkbox(
+                value=False,
+                data=file_path,
+                on_change=self.checkbox_changed,
+                scale=1.2,
+            )
             c = ft.Container(
                 content=ft.Row(
                     [
-                        ft.Checkbox(
-                            value=False,
-                            data=file_path,
-                            on_change=self.checkbox_changed,
-                            scale=1.2,
-                        ),
+                        checkbox,
                         ft.Column(
                             [
                                 ft.Text(file, size=14, weight=ft.FontWeight.W_500),
@@ -467,46 +596,93 @@ class MarkdownCollector:
                 ),
                 padding=ft.padding.symmetric(horizontal=5, vertical=8),
                 border_radius=8,
+                data=file_path,
             )
+            # 走査時に参照するチェックボックスと casefold したファイル名を保持
+            c._checkbox = checkbox
+            c._file_name_lower = file_name_lower
+            c.is_folder = False
             controls.append(c)
-            self.check_values[file_path] = False
-            self.file_paths.append(file_path)
+            tree.check_values[file_path] = False
+            tree.file_order[file_path] = len(tree.file_paths)
+            tree.file_paths.append(file_path)
+
+    def _scan_directory(
+        self,
+        directory: str,
+        tree: _LoadedTree,
+        mtime_ns: Optional[int] = None,
+    ) -> List[Tuple[str, bool, Optional[os.DirEntry]]]:
+        """
+        ディレクトリ内のフォルダ・ファイルの (名前, フォルダか, DirEntry) 一覧。
+        更新日時が前回と同じならキャッシュを使う(この場合 DirEntry は None)。
+        """
+        if mtime_ns is None:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self._dir_cache.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            tree.dir_cache[directory] = cached
+            return [(name, is_dir, None) for name, is_dir in cached[1]]
+
+        # キャッシュには名前と種別だけを覚える(stat 結果は古くなるので残さない)
+        entries = []
+        names = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    is_dir = True
+                elif entry.is_file():
+                    is_dir = False
+                else:
+                    continue
+                entries.append((entry.name, is_dir, entry))
+                names.append((entry.name, is_dir))
+        tree.dir_cache[directory] = (mtime_ns, names)
+        return entries
 
     def _format_size(self, size: int) -> str:
-        for unit in ["B", "KB", "MB", "GB"]:
-            if size < 1024:
-                return f"{size:.1f}{unit}"
-            size /= 1024
-        return f"{size:.1f}TB"
+        if size <= 0:
+            return "0.0B"
+        # 1024 = 2**10 なので、ビット長から単位を直接求める
+        i = min((size.bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+        return f"{size / (1 << (i * 10)):.1f}{SIZE_UNITS[i]}"
 
     def _format_date(self, ts: float) -> str:
-        return datetime.fromtimestamp(ts).strftime("%Y/%m/%d %H:%M")
+        return _format_minute(int(ts // 60))
 
     def _filter_files(self, e):
-        search_text = self.search_box.value.strip().lower()
-        if not search_text:
-            # フィルタ解除 → 全てを元に戻す
+        """入力のたびに呼ばれる。入力が止まってから一度だけフィルタを適用する"""
+        if self._filter_timer is not None:
+            self._filter_timer.cancel()
+        self._filter_timer = threading.Timer(
+            FILTER_DEBOUNCE_SECONDS,
+            self.page.run_thread,
+            args=(self._apply_search_filter,),
+        )
+        self._filter_timer.daemon = True
+        self._filter_timer.start()
+
+    def _apply_search_filter(self):
+        # 一覧のコントロール自体は入れ替えず、visible の切り替えだけで絞り込む
+        with self._filter_lock:
+            search_text = self.search_box.value.strip().casefold()
+            if not search_text:
+                # フィルタ解除 → 全てを元に戻す
+                for c in self.original_controls:
+                    if c.is_folder:
+                        c.restore_original_state()
+                    c.visible = True
+                self.files_column.update()
+                return
+
+            # フィルタ適用
             for c in self.original_controls:
-                if isinstance(c, Collapsible):
+                if c.is_folder:
                     c.restore_original_state()
-            self.files_column.controls = self.original_controls.copy()
-            self.page.update()
-            return
-
-        # フィルタ適用
-        filtered = []
-        for c in self.original_controls:
-            if isinstance(c, Collapsible):
-                c.restore_original_state()
-                if c.apply_filter(search_text):
-                    filtered.append(c)
-            else:
-                file_path = c.content.controls[0].data
-                file_name = os.path.basename(file_path).lower()
-                if search_text in file_name:
-                    filtered.append(c)
-        self.files_column.controls = filtered
-        self.page.update()
+                    c.visible = c.apply_filter(search_text)
+                else:
+                    c.visible = search_text in c._file_name_lower
+            self.files_column.update()
 
     def _sort_files(self, e=None):
         if not self.files_column.controls:
@@ -518,156 +694,213 @@ class MarkdownCollector:
         folders = []
         files = []
         for c in controls:
-            if isinstance(c, Collapsible):
+            if c.is_folder:
                 folders.append(c)
             else:
                 files.append(c)
 
-        def get_sort_value(c):
-            if isinstance(c, Collapsible):
-                return c.title.lower()
-            else:
-                path = c.content.controls[0].data
-                info = self.file_info[path]
-                if sort_key.startswith("name"):
-                    return info["name"].lower()
-                elif sort_key.startswith("date"):
-                    return info["modified"]
-                else:  # size
-                    return info["size"]
+        # ソートキーは読み込み時に計算済みのものを引くだけにする
+        # フォルダは常に名前順、ファイルは name / date / size のいずれか
+        sort_field = self.sort_keys[sort_key.split("_")[0]]
 
         reverse = sort_key.endswith("desc")
-        folders.sort(key=get_sort_value, reverse=reverse)
-        files.sort(key=get_sort_value, reverse=reverse)
+        folders.sort(key=lambda c: c._title_lower, reverse=reverse)
+        files.sort(key=lambda c: sort_field[c.data], reverse=reverse)
 
         self.files_column.controls = folders + files
-        if not self.search_box.value.strip():
-            self.original_controls = self.files_column.controls.copy()
+        self.original_controls = self.files_column.controls.copy()
         self.page.update()
 
     def _select_all_files(self, e):
-        for c in self.files_column.controls:
-            if isinstance(c, Collapsible):
-                c.set_files_checked(True)
-                for file_c in c.get_all_files():
-                    cb = file_c.content.controls[0]
-                    self.check_values[cb.data] = True
-                    cb.value = True
-                    cb.update()
-            else:
-                cb = c.content.controls[0]
-                cb.value = True
-                self.check_values[cb.data] = True
-                cb.update()
-        self.update_markdown_output()
-        self.page.update()
+        self._set_all_files_checked(True)
 
     def _deselect_all_files(self, e):
-        for c in self.files_column.controls:
-            if isinstance(c, Collapsible):
-                c.set_files_checked(False)
-                for file_c in c.get_all_files():
-                    cb = file_c.content.controls[0]
-                    self.check_values[cb.data] = False
-                    cb.value = False
-                    cb.update()
-            else:
-                cb = c.content.controls[0]
-                cb.value = False
-                self.check_values[cb.data] = False
-                cb.update()
-        self.update_markdown_output()
+        self._set_all_files_checked(False)
+
+    def _set_all_files_checked(self, checked: bool):
+        """表示中の全ファイルを一括でON/OFF。UIと出力の更新は最後に1回だけ行う"""
+        with self._deferred_output():
+            for c in self.files_column.controls:
+                if not c.visible:
+                    # フィルタで非表示の項目は対象外
+                    continue
+                if c.is_folder:
+                    # 配下ファイルの check_values と三状態は on_change 経由で更新される
+                    c.set_files_checked(checked, defer_update=True)
+                else:
+                    cb = c._checkbox
+                    cb.value = checked
+                    self.check_values[cb.data] = checked
+        self._request_markdown_output()
         self.page.update()
 
+    @contextmanager
+    def _deferred_output(self):
+        """この中での個々のチェック変更では出力・UIを更新しない(呼び出し側で最後に1回行う)"""
+        self._defer_output = True
+        try:
+            yield
+        finally:
+            self._defer_output = False
+
     def checkbox_changed(self, e):
         """個々のファイルのチェックボックスが切り替わった"""
-        self.check_values[e.control.data] = e.control.value
-        # 親フォルダがあれば三状態再計算
-        self._recalc_parent_folders()
-        self.update_markdown_output()
-        self.page.update()
+        path = e.control.data
+        if path not in self.check_values:
+            # 読み込み直す前の一覧に残っていたチェックボックス
+            return
+        delta = int(bool(e.control.value)) - int(bool(self.check_values.get(path)))
+        self.check_values[path] = e.control.value
+        # 親フォルダがあればチェック数を差分更新(三状態も再計算される)
+        folder = self.parent_folders.get(path)
+        if folder is not None and delta:
+            folder.on_leaf_toggled(delta)
+        if not self._defer_output:
+            self._request_markdown_output(path)
+            self.page.update()
 
     def _update_folder_state(self, folder: Collapsible):
         """
         フォルダ全体をセットした場合(IconButtonクリックで全ON/全OFFされたとき)の処理。
+        配下ファイルの self.check_values は on_change 経由で更新済み。
+        三状態も、切り替わったファイルの祖先は on_leaf_toggled で、
+        辿ったフォルダは set_files_checked の最後で更新済み(木全体は走査しない)。
         """
-        # 全配下ファイルの状態を self.check_values に反映
-        for file_c in folder.get_all_files():
-            cb = file_c.content.controls[0]
-            self.check_values[cb.data] = (folder._folder_state is True)
-
-        # 親フォルダの三状態再計算
-        self._recalc_parent_folders()
-        self.update_markdown_output()
+        self._request_markdown_output()
         self.page.update()
 
-    def _recalc_parent_folders(self):
+    def _request_markdown_output(self, changed_path: Optional[str] = None):
         """
-        全フォルダについて三状態チェックを再計算してアップデート。
+        出力の更新をバックグラウンドで行う。
+        changed_path を指定した場合は、そのファイルのブロックだけを差し替える。
+        連続して要求された場合、出力欄への反映は最後に処理された要求だけで行う。
         """
-        # すべての Collapsible を走査
-        def recurse(c):
-            if isinstance(c, Collapsible):
-                for sub in c.content.controls:
-                    recurse(sub)
-                c.recalc_folder_state()
-
-        for top_c in self.files_column.controls:
-            recurse(top_c)
-
-    def update_markdown_output(self):
-        tree = self._generate_tree_structure()
-        docs = []
-        for path, checked in self.check_values.items():
-            if checked:
-                rel_path = os.path.relpath(path, self.folder_path)
-                try:
-                    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                        content = f.read()
-                    docs.append(f"## {rel_path}\n```\n{content}\n```")
-                except Exception as err:
-                    docs.append(f"## {rel_path}\n```\nエラー: {err}\n```")
-        self.output_text.value = tree + "\n".join(docs)
-
-    def _generate_tree_structure(self) -> str:
-        """選択されたファイルのパスをもとにASCIIツリーを生成"""
-        def add_to_tree(path: str, tree: dict):
-            parts = os.path.normpath(path).split(os.sep)
-            current = tree
-            for i, part in enumerate(parts):
-                if i == len(parts) - 1:
-                    current[part] = None
-                else:
-                    if part not in current:
-                        current[part] = {}
-                    current = current[part]
+        with self._output_pending_lock:
+            self._output_pending += 1
+        self.page.run_thread(self._update_markdown_output_in_background, changed_path)
+
+    def _update_markdown_output_in_background(self, changed_path: Optional[str]):
+        with self._output_lock:
+            # ブロックの差し替えは要求ごとに必ず行う
+            if changed_path is None:
+                self._sync_output_blocks()
+            else:
+                self._update_output_block(changed_path)
+            # 要求は複数のスレッドで処理されるので、新しい要求が先に終わることもある。
+            # まだ処理されていない要求が残っていれば、出力欄への反映はそちらに任せる
+            with self._output_pending_lock:
+                self._output_pending -= 1
+                if self._output_pending:
+                    return
+            self.output_text.value = self._assemble_output()
+            self.output_text.update()
+
+    def _sync_output_blocks(self):
+        """選択中の全ファイルのブロックを用意し、選択外のブロックを破棄"""
+        paths = [path for path, checked in self.check_values.items() if checked]
+        if len(paths) > PARALLEL_READ_THRESHOLD:
+            # ファイル読み込みは I/O 待ちが中心なので、スレッドで並行して読む
+            with ThreadPoolExecutor(max_workers=min(MAX_READ_WORKERS, len(paths))) as ex:
+                list(ex.map(self._render_block, paths))
+        else:
+            for path in paths:
+                self._render_block(path)
+
+        for path in [p for p in self._rendered_blocks if not self.check_values.get(p)]:
+            del self._rendered_blocks[path]
+
+    def _update_output_block(self, path: str):
+        """1ファイルのチェック切り替えを反映(他のファイルは読み直さない)"""
+        if self.check_values.get(path):
+            self._render_block(path)
+        else:
+            self._rendered_blocks.pop(path, None)
+
+    def _assemble_output(self) -> str:
+        """用意済みのブロックとツリーから出力文字列を組み立てる(ファイル I/O なし)"""
+        paths = sorted(self._rendered_blocks, key=self.file_order.__getitem__)
+
+        # 各ファイルのブロックは部品のリストへ積んで最後に1回だけ結合する
+        parts = [self._generate_tree_structure(paths)]
+        separator = ""
+        for path in paths:
+            parts.append(separator)
+            parts.append(self._rendered_blocks[path][1])
+            separator = "\n"
+        return "".join(parts)
+
+    def _render_block(self, path: str) -> str:
+        """1ファイル分の出力ブロック。サイズと更新日時が変わっていなければ再読込しない"""
+        try:
+            stat = os.stat(path)
+            key = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            key = None
+        cached = self._rendered_blocks.get(path)
+        if key is not None and cached is not None and cached[0] == key:
+            return cached[1]
+
+        try:
+            content = self._read_text(path)
+        except Exception as err:
+            content = f"エラー: {err}"
+        block = "".join(("## ", self.rel_paths[path], "\n```\n", content, "\n```"))
+        # key が None(stat 失敗)のブロックは次回必ず読み直す
+        self._rendered_blocks[path] = (key, block)
+        return block
+
+    def _read_text(self, path: str) -> str:
+        """ファイルをバイナリで読み、UTF-8として一度にデコードする"""
+        with open(path, "rb") as f:
+            # 先頭に NUL バイトがあればバイナリとみなし、残りは読まない
+            head = f.read(BINARY_SNIFF_SIZE)
+            if b"\x00" in head:
+                return BINARY_PLACEHOLDER
+            text = (head + f.read()).decode("utf-8", "ignore")
+        if "\r" in text:
+            # テキストモードで読んだ場合と同じく改行を \n に揃える
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
 
+    def _generate_tree_structure(self, paths: List[str]) -> str:
+        """選択されたファイルのパスをもとにASCIIツリーを生成"""
+        # 読み込み時に分割済みのパス要素から辞書の木を組み立てる
         tree = {}
-        for path, checked in self.check_values.items():
-            if checked:
-                rel = os.path.relpath(path, self.folder_path)
-                add_to_tree(rel, tree)
+        for path in paths:
+            *dirs, file_name = self.rel_parts[path]
+            current = tree
+            for part in dirs:
+                current = current.setdefault(part, {})
+            current[file_name] = None
 
         if not tree:
             return ""
 
-        def build_str(subtree: dict, prefix: str=""):
-            lines = []
-            items = sorted(subtree.items())
-            for i, (name, val) in enumerate(items):
-                is_last = (i == len(items)-1)
-                connector = "└── " if is_last else "├── "
-                lines.append(prefix + connector + name)
-                if val is not None:
-                    extension = "    " if is_last else "│   "
-                    lines.append(build_str(val, prefix+extension))
-            return "\n".join(lines)
+        # 再帰せず、明示的なスタックで行を出力する(各階層は名前順)
+        lines = []
+        stack = []
+
+        def push_children(subtree: dict, prefix: str):
+            names = sorted(subtree)
+            last = len(names) - 1
+            for i in range(last, -1, -1):
+                stack.append((names[i], subtree[names[i]], prefix, i == last))
+
+        push_children(tree, "")
+        while stack:
+            name, val, prefix, is_last = stack.pop()
+            connector = "└── " if is_last else "├── "
+            lines.append(prefix + connector + name)
+            if val is not None:
+                extension = "    " if is_last else "│   "
+                push_children(val, prefix + extension)
 
         root_name = os.path.basename(self.folder_path)
-        text = f"# Directory Structure\n```\n{root_name}\n"
-        text += build_str(tree)
-        text += "\n```\n\n"
-        return text
+        return "".join((
+            f"# Directory Structure\n```\n{root_name}\n",
+            "\n".join(lines),
+            "\n```\n\n",
+        ))
 
     def save_markdown(self, e):
         text = self.output_text.value.strip()
@@ -684,13 +917,17 @@ class MarkdownCollector:
 
     def save_file_result(self, e: ft.FilePickerResultEvent):
         if e.path:
-            try:
-                with open(e.path, "w", encoding="utf-8") as f:
-                    f.write(self.output_text.value)
-                self._show_success(f"保存しました: {e.path}")
-            except Exception as err:
-                self._show_error(f"保存失敗: {err}")
-            self.page.update()
+            # 書き込みはバックグラウンドで行う
+            self.page.run_thread(self._write_markdown_file, e.path, self.output_text.value)
+
+    def _write_markdown_file(self, path: str, text: str):
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            self._show_success(f"保存しました: {path}")
+        except Exception as err:
+            self._show_error(f"保存失敗: {err}")
+        self.page.update()
 
     def copy_to_clipboard(self, e):
         text = self.output_text.value.strip()
@@ -790,23 +1027,16 @@ class MarkdownCollector:
         if self.settings_dialog:
             self.page.close(self.settings_dialog)
 
-    def _should_exclude(self, path: str, name: str) -> bool:
+    def _should_exclude(self, name: str, is_dir: bool) -> bool:
         # 拡張子チェック
-        if any(name.endswith(ext) for ext in self.exclude_patterns['extensions']):
+        if name.endswith(self._excluded_exts):
             return True
         # ファイル名
-        if name in self.exclude_patterns['files']:
+        if name in self._excluded_files:
             return True
-        # フォルダ名
-        if os.path.isdir(path) and name in self.exclude_patterns['folders']:
+        # フォルダ名(除外フォルダは中身を走査しない)
+        if is_dir and name in self._excluded_folders:
             return True
-        # サイズ
-        if os.path.isfile(path):
-            try:
-                if os.path.getsize(path) > self.exclude_patterns['max_file_size']:
-                    return True
-            except:
-                return True
         return False
 
     def _show_error(self, msg: str):
@@ -836,12 +1066,20 @@ class MarkdownCollector:
             return {}
 
     def _save_config(self):
+        config_hash = self._hash_config()
+        if config_hash == self._config_hash:
+            # 前回の読み込み・保存から変更が無ければ書き込まない
+            return
         try:
             with open(CONFIG_FILE, "w", encoding="utf-8") as f:
                 json.dump(self.config, f, ensure_ascii=False, indent=2)
+            self._config_hash = config_hash
         except Exception as err:
             print(f"設定ファイルの保存に失敗: {err}")
 
+    def _hash_config(self) -> int:
+        return hash(json.dumps(self.config, sort_keys=True))
+
 def main(page: ft.Page):
     MarkdownCollector(page)
 